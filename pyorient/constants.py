@@ -1,5 +1,7 @@
 __author__ = 'mogui <mogui83@gmail.com>'
 
+import struct as _struct
+
 #
 # Driver Constants
 #
@@ -47,6 +49,15 @@ FIELD_TYPE_LINK = {"type": LINK, "bytes": None, "struct": [
     FIELD_LONG,   # record_position
 ]}
 
+# Precompiled big endian formats of the numeric types,
+# faster than struct.pack/unpack with a format string
+STRUCT_SHORT = _struct.Struct("!h")
+STRUCT_INT = _struct.Struct("!i")
+STRUCT_LONG = _struct.Struct("!q")
+# fixed size heads of FIELD_RECORD and FIELD_TYPE_LINK, read in one go
+STRUCT_RECORD_HEAD = _struct.Struct("!chqi")  # type, cluster, position, version
+STRUCT_LINK = _struct.Struct("!hq")  # cluster, position
+
 
 SHUTDOWN                 = "ShutdownMessage"
 CONNECT                  = "ConnectMessage"
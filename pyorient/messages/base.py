@@ -1,6 +1,5 @@
 __author__ = 'Ostico <ostico@gmail.com>'
 
-import struct
 import sys
 
 from ..exceptions import PyOrientBadMethodCallException, \
@@ -10,11 +9,19 @@ from ..otypes import OrientRecord, OrientRecordLink, OrientNode
 from ..hexdump import hexdump
 from ..constants import BOOLEAN, BYTE, BYTES, CHAR, FIELD_BOOLEAN, FIELD_BYTE, \
     FIELD_INT, FIELD_RECORD, FIELD_SHORT, FIELD_STRING, FIELD_TYPE_LINK, INT, \
-    LINK, LONG, RECORD, SHORT, STRING, STRINGS
+    LINK, LONG, RECORD, SHORT, STRING, STRINGS, STRUCT_INT, STRUCT_LINK, \
+    STRUCT_LONG, STRUCT_RECORD_HEAD, STRUCT_SHORT
 from ..utils import is_debug_active
 from ..orient import OrientSocket
 from ..serializations import OrientSerialization
 
+# numeric types decoded straight from the socket buffer
+_NUMERIC_STRUCTS = {
+    SHORT: STRUCT_SHORT,
+    INT: STRUCT_INT,
+    LONG: STRUCT_LONG,
+}
+
 class BaseMessage(object):
 
     def __init__(self, sock=OrientSocket):
@@ -33,6 +40,10 @@ class BaseMessage(object):
         self._header = []
         """:type : list of [str]"""
 
+        # set when the server answered with an error, the whole
+        # response has been read and the stream is still in sync
+        self._server_error = False
+
         self._body = []
         """:type : list of [str]"""
 
@@ -48,9 +59,13 @@ class BaseMessage(object):
 
         self._serializer = None
 
+        self._output_parts = []
         self._output_buffer = b''
         self._input_buffer = b''
 
+        # raw streams are only kept to be dumped in debug mode
+        self._debug = is_debug_active()
+
         # callback function for async queries
         self._callback = None
 
@@ -139,9 +154,13 @@ class BaseMessage(object):
                 2, ( FIELD_STRING, self._auth_token )
             )
 
-        self._output_buffer = b''.join(
-            self._encode_field( x ) for x in self._fields_definition
-        )
+        # keep the encoded fields apart, the socket gathers them
+        # in a single write without concatenating them first
+        self._output_parts = []
+        for x in self._fields_definition:
+            self._output_parts += self._encode_field_parts( x )
+        if self._debug:
+            self._output_buffer = b''.join( self._output_parts )
         return self
 
     def get_protocol(self):
@@ -177,6 +196,7 @@ class BaseMessage(object):
                     # trash
                     del serialized_exception
 
+            self._server_error = True
             raise PyOrientCommandException(
                 exception_class.decode( 'utf8' ),
                 [ exception_message.decode( 'utf8' ) ]
@@ -292,7 +312,7 @@ class BaseMessage(object):
 
     def send(self):
         if self._orientSocket.in_transaction is False:
-            self._orientSocket.write( self._output_buffer )
+            self._orientSocket.write_message( *self._output_parts )
             self._reset_fields_definition()
         if is_debug_active():
             self.dump_streams()
@@ -306,29 +326,37 @@ class BaseMessage(object):
 
     @staticmethod
     def _encode_field(field):
+        return b''.join( BaseMessage._encode_field_parts( field ) )
+
+    @staticmethod
+    def _encode_field_parts(field):
+        """
+        Encode a field as a list of buffers, strings and bytes are kept
+        apart from their length prefix so they are never copied to be sent
+        """
 
         # tuple with type
         t, v = field
-        _content = None
+        _content = []
 
         if t['type'] == INT:
-            _content = struct.pack("!i", v)
+            _content.append( STRUCT_INT.pack(v) )
         elif t['type'] == SHORT:
-            _content = struct.pack("!h", v)
+            _content.append( STRUCT_SHORT.pack(v) )
         elif t['type'] == LONG:
-            _content = struct.pack("!q", v)
+            _content.append( STRUCT_LONG.pack(v) )
         elif t['type'] == BOOLEAN:
             if sys.version_info[0] < 3:
-                _content = chr(1) if v else chr(0)
+                _content.append( chr(1) if v else chr(0) )
             else:
-                _content = bytes([1]) if v else bytes([0])
+                _content.append( bytes([1]) if v else bytes([0]) )
         elif t['type'] == BYTE:
             if sys.version_info[0] < 3:
-                _content = v
+                _content.append( v )
             else:
-                _content = bytes([ord(v)])
+                _content.append( bytes([ord(v)]) )
         elif t['type'] == BYTES:
-            _content = struct.pack("!i", len(v)) + v
+            _content += [ STRUCT_INT.pack(len(v)), v ]
         elif t['type'] == STRING:
             if sys.version_info[0] >= 3:
                 if isinstance(v, str):
@@ -336,9 +364,8 @@ class BaseMessage(object):
             else:
                 if isinstance(v, unicode):
                     v = v.encode('utf-8')
-            _content = struct.pack("!i", len(v)) + v
+            _content += [ STRUCT_INT.pack(len(v)), v ]
         elif t['type'] == STRINGS:
-            _content = b''
             for s in v:
                 if sys.version_info[0] >= 3:
                     if isinstance(s, str):
@@ -346,11 +373,32 @@ class BaseMessage(object):
                 else:
                     if isinstance(s, unicode):
                         s = s.encode('utf-8')
-                _content += struct.pack("!i", len(s)) + s
+                _content += [ STRUCT_INT.pack(len(s)), s ]
 
         return _content
 
     def _decode_field(self, _type):
+        if not self._debug:
+            # the raw bytes are not needed for the debug dump,
+            # decode without copying them out of the socket buffer
+            _struct = _NUMERIC_STRUCTS.get( _type['type'] )
+            if _struct is not None:
+                return self._orientSocket.read_struct( _struct )[0]
+            elif _type['type'] == STRING or _type['type'] == BYTES:
+                _len = self._orientSocket.read_struct( STRUCT_INT )[0]
+                if _len == -1 or _len == 0:
+                    return b''
+                return self._orientSocket.read( _len )
+            elif _type['type'] == RECORD:
+                record_type, cluster, position, version = \
+                    self._orientSocket.read_struct( STRUCT_RECORD_HEAD )
+                content = self._decode_field( _type['struct'][4] )
+                return {'rid': "#%d:%d" % ( cluster, position ),
+                        'record_type': record_type,
+                        'content': content, 'version': version}
+            elif _type['type'] == LINK:
+                return "#%d:%d" % self._orientSocket.read_struct( STRUCT_LINK )
+
         _value = b""
         # read buffer length and decode value by field definition
         if _type['bytes'] is not None:
@@ -359,14 +407,15 @@ class BaseMessage(object):
         # and try to read the buffer
         if _type['type'] == STRING or _type['type'] == BYTES:
 
-            _len = struct.unpack('!i', _value)[0]
+            _len = STRUCT_INT.unpack(_value)[0]
             if _len == -1 or _len == 0:
                 _decoded_string = b''
             else:
                 _decoded_string = self._orientSocket.read( _len )
 
-            self._input_buffer += _value
-            self._input_buffer += _decoded_string
+            if self._debug:
+                self._input_buffer += _value
+                self._input_buffer += _decoded_string
 
             return _decoded_string
 
@@ -390,7 +439,8 @@ class BaseMessage(object):
             return rid
 
         else:
-            self._input_buffer += _value
+            if self._debug:
+                self._input_buffer += _value
 
             if _type['type'] == BOOLEAN:
                 return ord(_value) == 1
@@ -399,11 +449,11 @@ class BaseMessage(object):
             elif _type['type'] == CHAR:
                 return _value
             elif _type['type'] == SHORT:
-                return struct.unpack('!h', _value)[0]
+                return STRUCT_SHORT.unpack(_value)[0]
             elif _type['type'] == INT:
-                return struct.unpack('!i', _value)[0]
+                return STRUCT_INT.unpack(_value)[0]
             elif _type['type'] == LONG:
-                return struct.unpack('!q', _value)[0]
+                return STRUCT_LONG.unpack(_value)[0]
 
     def _read_async_records(self):
         """
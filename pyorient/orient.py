@@ -6,15 +6,16 @@ from __future__ import print_function
 
 __author__ = 'Ostico <ostico@gmail.com>'
 
+import importlib
+import os
 import socket
-import struct
 import select
 
 from .exceptions import PyOrientBadMethodCallException, \
     PyOrientConnectionException, PyOrientWrongProtocolVersionException, \
-    PyOrientConnectionPoolException
+    PyOrientConnectionPoolException, PyOrientException
 
-from .constants import FIELD_SHORT, \
+from .constants import FIELD_SHORT, STRUCT_SHORT, \
     QUERY_ASYNC, QUERY_CMD, QUERY_GREMLIN, QUERY_SYNC, QUERY_SCRIPT, \
     SUPPORTED_PROTOCOL, DB_TYPE_DOCUMENT, \
     STORAGE_TYPE_PLOCAL, SOCK_CONN_TIMEOUT
@@ -48,6 +49,29 @@ type_map = {'BOOLEAN' :0,
             'LINKBAG' : 22,
             'ANY' : 23}
 
+# max number of buffers a single gather-write can take (IOV_MAX on Linux)
+_IOV_MAX = 1024
+
+_HAS_QUICKACK = hasattr( socket, 'TCP_QUICKACK' )
+
+# OrientDB attribute name -> message class name, see OrientDB.__getattr__
+_ATTR_CACHE = {}
+
+# size of the buffer the responses are received in, bigger reads
+# go straight to the socket
+_RECV_BUFFER_SIZE = 64 * 1024
+
+# max bytes of requests an OrientPipeline writes before reading their
+# responses: small enough to always fit in the socket buffers, so the
+# write can't block on a server busy sending back the first responses
+_PIPELINE_BATCH_BYTES = 64 * 1024
+
+def _buffer_size_from_env(name):
+    try:
+        return int( os.environ[name] )
+    except (KeyError, ValueError):
+        return None
+
 class OrientSocket(object):
     '''Class representing the binary connection to the database, it does all the low level comunication
     And holds information on server version and cluster map
@@ -57,14 +81,19 @@ class OrientSocket(object):
 
     :param host: hostname of the server to connect
     :param port: integer port of the server
+    :param sndbuf: size of the kernel send buffer in bytes, defaults to the
+      PYORIENT_SNDBUF environment variable or, if not set, to the OS autotuning
+    :param rcvbuf: size of the kernel receive buffer in bytes, defaults to the
+      PYORIENT_RCVBUF environment variable or, if not set, to the OS autotuning
 
     '''
-    def __init__(self, host, port, serialization_type=OrientSerialization.CSV ):
+    def __init__(self, host, port, serialization_type=OrientSerialization.CSV,
+                 sndbuf=None, rcvbuf=None ):
 
         self.connected = False
         self.host = host
         self.port = port
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket = None
         self.protocol = -1
         self.session_id = -1
         self.auth_token = b''
@@ -72,6 +101,14 @@ class OrientSocket(object):
         self.serialization_type = serialization_type
         self.in_transaction = False
         self._props = None
+        self._recv_buffer = bytearray()  # allocated on connect
+        self._recv_pos = 0
+        self._recv_end = 0
+        self._corked = None
+        self.sndbuf = sndbuf if sndbuf is not None \
+            else _buffer_size_from_env( 'PYORIENT_SNDBUF' )
+        self.rcvbuf = rcvbuf if rcvbuf is not None \
+            else _buffer_size_from_env( 'PYORIENT_RCVBUF' )
 
     def get_connection(self):
         if not self.connected:
@@ -84,19 +121,26 @@ class OrientSocket(object):
         could raise :class:`PyOrientConnectionPoolException`
         '''
         dlog("Trying to connect...")
+        if self._socket is not None:
+            self._socket.close()
+        self._recv_pos = self._recv_end = 0
+        if not self._recv_buffer:
+            self._recv_buffer = bytearray(_RECV_BUFFER_SIZE)
         try:
-            self._socket.settimeout( SOCK_CONN_TIMEOUT )  # 30 secs of timeout
-            self._socket.connect( (self.host, self.port) )
-            _value = self._socket.recv( FIELD_SHORT['bytes'] )
+            self._open_socket()
+            self._quick_ack()
+            # a single recv for the protocol version and anything the server
+            # already sent after it, the surplus stays in the receive buffer
+            self._recv_end = self._socket.recv_into( self._recv_buffer )
 
-            if len(_value) != 2:
+            if self._recv_end < FIELD_SHORT['bytes']:
                 self._socket.close()
 
                 raise PyOrientConnectionPoolException(
                     "Server sent empty string", []
                 )
 
-            self.protocol = struct.unpack('!h', _value)[0]
+            self.protocol = self.read_struct( STRUCT_SHORT )[0]
             if self.protocol > SUPPORTED_PROTOCOL:
                 raise PyOrientWrongProtocolVersionException(
                     "Protocol version " + str(self.protocol) +
@@ -106,6 +150,50 @@ class OrientSocket(object):
             self.connected = False
             raise PyOrientConnectionException( "Socket Error: %s" % e, [] )
 
+    def _open_socket(self):
+        # try every address the host resolves to, IPv6 or IPv4,
+        # until one of them accepts the connection
+        error = socket.error( "getaddrinfo returned no address" )
+        for family, socktype, proto, _, address in socket.getaddrinfo(
+                self.host, self.port, 0, socket.SOCK_STREAM ):
+            self._socket = socket.socket( family, socktype, proto )
+            try:
+                # the binary protocol is made of small request/reply frames,
+                # do not let Nagle hold them back waiting for a delayed ACK
+                self._socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+                self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1 )
+                self._set_buffer_sizes()
+                self._socket.settimeout( SOCK_CONN_TIMEOUT )  # 30 secs of timeout
+                self._socket.connect( address )
+                return
+            except socket.error as e:
+                dlog( "Connection to %s failed: %s" % ( address[0], e ) )
+                error = e
+                self._socket.close()
+        raise error
+
+    def _set_buffer_sizes(self):
+        # must happen before connect() for the TCP window scale to follow.
+        # Setting them disables the kernel autotuning, so it is only done
+        # when asked for, for links with a large bandwidth-delay product
+        if self.sndbuf:
+            self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                     self.sndbuf )
+            dlog( "SO_SNDBUF: %s" % self._socket.getsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF ) )
+        if self.rcvbuf:
+            self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                     self.rcvbuf )
+            dlog( "SO_RCVBUF: %s" % self._socket.getsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF ) )
+
+    def _quick_ack(self):
+        # Linux only: ACK immediately instead of waiting for the delayed-ACK
+        # timer. The kernel may drop back to delayed ACKs at any time,
+        # so it has to be re-armed after every read
+        if _HAS_QUICKACK:
+            self._socket.setsockopt( socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1 )
+
     def close(self):
         '''Close the inner connection
         '''
@@ -113,10 +201,40 @@ class OrientSocket(object):
         self.port = 0
         self.protocol = -1
         self.session_id = -1
-        self._socket.close()
+        if self._socket is not None:
+            self._socket.close()
         self.connected = False
+        self._recv_pos = self._recv_end = 0
+        self._corked = None
+
+    def _cork(self):
+        # Hold the messages written from now on, until _uncork() sends them
+        # all with a single write. Nothing leaves the client meanwhile: no
+        # request may wait for its response while the socket is corked
+        if self._corked is None:
+            self._corked = []
+
+    def _uncork(self):
+        # Send the messages held since _cork()
+        corked, self._corked = self._corked, None
+        if corked:
+            return self.write_message( *corked )
+        return 0
 
     def write(self, buff):
+        return self.write_message( buff )
+
+    def write_message(self, *buffs):
+        '''Send all the given buffers as one logical message
+
+        Where the platform supports it the buffers are handed to the kernel
+        in a single gather-write, otherwise they are joined and sent at once,
+        so a message never leaves the client split in several small segments
+        '''
+        if self._corked is not None:
+            self._corked.extend( buffs )
+            return sum( len(b) for b in buffs )
+
         # This is a trick to detect server disconnection
         # or broken line issues because of
         """:see: https://docs.python.org/2/howto/sockets.html#when-sockets-die """
@@ -130,56 +248,167 @@ class OrientSocket(object):
             raise e
 
         if not in_error and ready_to_write:
-            self._socket.sendall(buff)
-            return len(buff)
+            try:
+                if hasattr( self._socket, 'sendmsg' ):
+                    self._send_gather( buffs )
+                else:
+                    self._socket.sendall( b''.join( buffs ) )
+            except socket.timeout:
+                # part of the message may be gone already, the server
+                # would read the next one from the middle of this
+                self.connected = False
+                self._socket.close()
+                raise PyOrientConnectionException(
+                    "Socket timed out while sending the request", [])
+            return sum( len(b) for b in buffs )
         else:
             self.connected = False
             self._socket.close()
             raise PyOrientConnectionException("Socket error", [])
 
+    def _send_gather(self, buffs):
+        # sendmsg, like send, may return before everything is written:
+        # drop the chunks already sent and go on with the rest
+        views = [ memoryview(b) for b in buffs if len(b) ]
+        while views:
+            sent = self._socket.sendmsg( views[:_IOV_MAX] )
+            while sent:
+                if sent >= len( views[0] ):
+                    sent -= len( views.pop(0) )
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+
     # The man page for recv says: The receive calls normally return
     #   any data available, up to the requested amount, rather than waiting
     #   for receipt of the full amount requested.
     #
-    # If you need to read a given number of bytes, you need to call recv
-    #   in a loop and concatenate the returned packets until
-    #   you have read enough.
+    # Responses are decoded a few bytes at a time, so instead of asking the
+    #   kernel for exactly what is needed we drain whatever it has buffered
+    #   into our own receive buffer and serve the next reads from there.
     def read(self, _len_to_read):
 
-        while True:
+        if _len_to_read > len(self._recv_buffer):
+            # too big for the receive buffer, read it straight in place
+            buf = bytearray(_len_to_read)
+            self.read_into(buf)
+            return bytes(buf)
 
-            # This is a trick to detect server disconnection
-            # or broken line issues because of
-            """:see: https://docs.python.org/2/howto/sockets.html#when-sockets-die """
-            try:
-                ready_to_read, _, in_error = \
-                    select.select( [self._socket, ], [], [self._socket, ], 30 )
-            except select.error as e:
-                self.connected = False
-                self._socket.close()
-                raise e
+        self._fill(_len_to_read)
+        start = self._recv_pos
+        self._recv_pos += _len_to_read
+        return memoryview(self._recv_buffer)[start:self._recv_pos].tobytes()
 
-            if len(ready_to_read) > 0:
+    def read_struct(self, _struct):
+        '''Unpack a :class:`struct.Struct` straight from the receive buffer,
+        without copying the bytes out of it first
 
-                buf = bytearray(_len_to_read)
-                view = memoryview(buf)
-                while _len_to_read:
-                    n_bytes = self._socket.recv_into(view, _len_to_read)
-                    if not n_bytes:
-                        self._socket.close()
-                        # TODO Implement re-connection to another listener
+        :param _struct: a precompiled struct, see STRUCT_* in constants
+        :return: tuple of the unpacked values
+        '''
+        self._fill(_struct.size)
+        values = _struct.unpack_from(self._recv_buffer, self._recv_pos)
+        self._recv_pos += _struct.size
+        return values
+
+    def peek(self, _len_to_read):
+        '''Return the next bytes of the response without consuming them
 
-                        raise PyOrientConnectionException(
-                            "Server seems to have went down", [])
+        The returned memoryview points into the receive buffer and is only
+        valid until the next read from this socket
+        '''
+        self._fill(_len_to_read)
+        return memoryview(self._recv_buffer)[
+            self._recv_pos:self._recv_pos + _len_to_read]
 
-                    view = view[n_bytes:]  # slicing views is cheap
-                    _len_to_read -= n_bytes
-                return bytes(buf)
+    def consume(self, _len_to_read):
+        '''Discard bytes already buffered, usually after a :meth:`peek`'''
+        if _len_to_read > self._recv_end - self._recv_pos:
+            raise PyOrientBadMethodCallException(
+                "Cannot consume more bytes than buffered", [])
+        self._recv_pos += _len_to_read
+
+    def read_into(self, view, _len_to_read=None):
+        '''Fill a writable buffer (bytearray, memoryview) with the data
+        coming from the server
+
+        :param view: the buffer to fill
+        :param _len_to_read: number of bytes to read, defaults to the buffer size
+        '''
+        if _len_to_read is None:
+            _len_to_read = len(view)
+        if not isinstance(view, memoryview):
+            view = memoryview(view)
+        view = view[:_len_to_read]
+
+        # first what is already buffered, then the rest straight from the socket
+        buffered = min(_len_to_read, self._recv_end - self._recv_pos)
+        if buffered:
+            view[:buffered] = memoryview(self._recv_buffer)[
+                self._recv_pos:self._recv_pos + buffered]
+            self._recv_pos += buffered
+        if _len_to_read > buffered:
+            self._recv_exactly(view[buffered:])
+        return _len_to_read
+
+    def _fill(self, _len_to_read):
+        # make sure at least _len_to_read bytes are in the receive buffer
+        available = self._recv_end - self._recv_pos
+        if available >= _len_to_read:
+            return
+
+        buf = self._recv_buffer
+        if self._recv_pos + _len_to_read > len(buf):
+            if _len_to_read > len(buf):
+                # not allocated yet or too small for this read
+                buf = bytearray( max( _len_to_read, _RECV_BUFFER_SIZE ) )
+            # not enough room left at the end, move what is pending in front
+            buf[:available] = self._recv_buffer[self._recv_pos:self._recv_end]
+            self._recv_buffer = buf
+            self._recv_pos = 0
+            self._recv_end = available
+
+        view = memoryview(buf)[self._recv_end:]
+        wanted = _len_to_read - available
+        got = self._recv_exactly(view, wanted, len(view))
+        self._recv_end += got
+
+    def _recv_exactly(self, view, _len_to_read=None, _max_len=None):
+        # receive at least _len_to_read bytes and, when _max_len is given,
+        # whatever else the kernel already has up to _max_len
+        if _len_to_read is None:
+            _len_to_read = len(view)
+        if _max_len is None:
+            _max_len = _len_to_read
+
+        # No select() before reading: the socket already has a timeout and
+        # a closed connection is detected by recv returning 0 bytes
+        received = 0
+        while received < _len_to_read:
+            try:
+                n_bytes = self._socket.recv_into(view[received:],
+                                                 _max_len - received)
+            except socket.timeout:
+                if received == 0:
+                    # nothing received yet, the server is still working
+                    # on the request: keep waiting as select() did
+                    continue
+                self.connected = False
+                self._socket.close()
+                raise PyOrientConnectionException(
+                    "Socket timed out while reading the response", [])
 
-            if len(in_error) > 0:
+            if not n_bytes:
+                self.connected = False
                 self._socket.close()
+                # TODO Implement re-connection to another listener
+
                 raise PyOrientConnectionException(
-                    "Socket error", [])
+                    "Server seems to have went down", [])
+
+            received += n_bytes
+            self._quick_ack()
+        return received
 
 
 
@@ -202,6 +431,8 @@ class OrientDB(object):
     _connection  = None
     _auth_token  = None
 
+    # message name -> module path, replaced by the message class itself
+    # the first time it is used (see _get_message_class)
     _Messages = dict(
         # Server
         ConnectMessage="pyorient.messages.connection",
@@ -262,12 +493,24 @@ class OrientDB(object):
         if item.startswith("_"):
             return super(OrientDB, self).__getattr__(item)
 
-        _names = "".join( [i.capitalize() for i in item.split('_')] )
-        _Message = self.get_message(_names + "Message")
+        _name = _ATTR_CACHE.get(item)
+        if _name is None:
+            _name = \
+                "".join( [i.capitalize() for i in item.split('_')] ) + "Message"
 
-        def wrapper(*args, **kw):
-            return _Message.prepare( args ).send().fetch_response()
-        return wrapper
+        # fail early on unknown commands, as before; only the valid
+        # names are cached, not every misspelling
+        self._get_message_class(_name)
+        _ATTR_CACHE[item] = _name
+
+        def wrapper(self, *args, **kw):
+            return self.get_message(_name) \
+                .prepare( args ).send().fetch_response()
+
+        # next lookups find the method on the class without going through
+        # __getattr__; stored on the instance it would be a reference cycle
+        setattr(type(self), item, wrapper)
+        return getattr(self, item)
 
     def _reload_clusters(self):
         self._cluster_map = dict([(cluster.name, cluster.id) for cluster in self.clusters])
@@ -520,34 +763,57 @@ class OrientDB(object):
     def tx_commit(self):
         return self.get_message("TxCommitMessage")
 
+    def pipeline(self):
+        """
+        Queue several commands and send them all before reading any response,
+        so they cost one round trip to the server instead of one each
+
+        The requests are written in batches of at most 64KB, the responses
+        of a batch are read before the next one is sent; a single request
+        bigger than that goes alone.
+
+        :return: an :class:`OrientPipeline <pyorient.orient.OrientPipeline>` object
+
+        Usage::
+
+            >>> pipe = client.pipeline()
+            >>> pipe.record_load("#11:0").record_load("#11:1")
+            >>> pipe.command("select from V where name = 'foo'")
+            >>> first, second, found = pipe.execute()
+        """
+        return OrientPipeline(self)
+
     def get_message(self, command=None):
-        try:
-            if command is not None and self._Messages[command]:
-                _msg = __import__(
-                    self._Messages[command],
-                    globals(),
-                    locals(),
-                    [command]
-                )
+        if command is None:
+            return None
 
-                # Get the right instance from Import List
-                _Message = getattr(_msg, command)
-                if self._connection.auth_token != b'':
-                    token = self._connection.auth_token
-                else:
-                    token = self._auth_token
+        _Message = self._get_message_class(command)
+
+        # the token stored on the connection wins over the client request
+        token = self._connection.auth_token or self._auth_token
 
-                message_instance = _Message(self._connection)\
-                    .set_session_token(token)
-                message_instance._push_callback = self._push_received
-                return message_instance
+        message_instance = _Message(self._connection)\
+            .set_session_token(token)
+        message_instance._push_callback = self._push_received
+        return message_instance
 
+    def _get_message_class(self, command):
+        try:
+            _Message = self._Messages[command]
         except KeyError as e:
             self.close()
             raise PyOrientBadMethodCallException(
                 "Unable to find command " + str(e), []
             )
 
+        if isinstance(_Message, str):
+            # Message modules import this one, so they can not be imported
+            # when the class is defined: import each one on first use
+            # and keep the class in place of its module path
+            _Message = getattr(importlib.import_module(_Message), command)
+            self._Messages[command] = _Message
+        return _Message
+
     def _push_received(self, command_id, payload):
         # REQUEST_PUSH_RECORD	        79
         # REQUEST_PUSH_DISTRIB_CONFIG	80
@@ -556,3 +822,120 @@ class OrientDB(object):
         # an object of something, like a new array of cluster.
         if command_id == 80:
             pass
+
+
+class OrientPipeline(object):
+    """Commands queued to be sent together on an :class:`OrientDB` connection
+
+    The server answers the requests of a connection one after the other,
+    in the order they were received: all the requests are written first and
+    the responses are then read back in the same order, overlapping the
+    round trips instead of waiting for each one.
+
+    Only commands that do not change the connection state can be queued,
+    open the database before and do not use it inside a transaction.
+
+    :param client: the :class:`OrientDB` client whose connection is used
+    """
+    def __init__(self, client):
+        self._client = client
+        self._messages = []
+
+    def __len__(self):
+        return len(self._messages)
+
+    def _queue(self, command, args):
+        self._messages.append(
+            self._client.get_message(command).prepare(args)
+        )
+        return self
+
+    def command(self, *args):
+        return self._queue("CommandMessage", ( QUERY_CMD, ) + args)
+
+    def query(self, *args):
+        return self._queue("CommandMessage", ( QUERY_SYNC, ) + args)
+
+    def gremlin(self, *args):
+        return self._queue("CommandMessage", ( QUERY_GREMLIN, ) + args)
+
+    def batch(self, *args):
+        return self._queue("CommandMessage", ( QUERY_SCRIPT, ) + args)
+
+    def record_create(self, *args):
+        return self._queue("RecordCreateMessage", args)
+
+    def record_delete(self, *args):
+        return self._queue("RecordDeleteMessage", args)
+
+    def record_load(self, *args):
+        return self._queue("RecordLoadMessage", args)
+
+    def record_update(self, *args):
+        return self._queue("RecordUpdateMessage", args)
+
+    def data_cluster_count(self, *args):
+        return self._queue("DataClusterCountMessage", args)
+
+    def execute(self):
+        """
+        Send the queued commands in batches and read their responses
+
+        Every response is read even if the server answers some of them
+        with an error, so the connection stays usable; the first error is
+        raised afterwards. Any other failure leaves the rest of the
+        responses unread on the wire: the connection is closed and the
+        exception raised at once.
+
+        :return: list of the results, in the order the commands were queued
+        """
+        messages, self._messages = self._messages, []
+
+        results = []
+        errors = []
+        batch = []
+        batch_size = 0
+        for message in messages:
+            size = sum( len(b) for b in message._output_parts )
+            if batch and batch_size + size > _PIPELINE_BATCH_BYTES:
+                self._execute_batch( batch, results, errors )
+                batch = []
+                batch_size = 0
+            batch.append( message )
+            batch_size += size
+        if batch:
+            self._execute_batch( batch, results, errors )
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def _execute_batch(self, messages, results, errors):
+        # all the requests of the batch leave in the same write
+        connection = self._client._connection
+        connection._cork()
+        try:
+            for message in messages:
+                message.send()
+        except:
+            # part of the batch is queued: never send it, and don't leave
+            # the socket corked for the next requests
+            connection.close()
+            raise
+        connection._uncork()
+
+        for message in messages:
+            try:
+                results.append( message.fetch_response() )
+            except PyOrientException as e:
+                if not message._server_error:
+                    # stopped in the middle of a response, the next ones
+                    # can't be found anymore
+                    connection.close()
+                    raise
+                # an error reported by the server, its response is consumed
+                results.append( None )
+                errors.append( e )
+            except Exception:
+                connection.close()
+                raise
@@ -315,6 +315,57 @@ class CommandTestCase(unittest.TestCase):
         assert len( client.query( "select from V LIMIT 21", 10 ) ) == 21
         assert len( client.query( "select from V" ) ) == 20
 
+    def test_pipeline(self):
+
+        client = pyorient.OrientDB("localhost", 2424)
+        client.connect("root", "root")
+
+        db_name = "GratefulDeadConcerts"
+
+        cluster_info = client.db_open(
+            db_name, "admin", "admin", pyorient.DB_TYPE_GRAPH, ""
+        )
+
+        pipe = client.pipeline()
+        pipe.record_load( "#11:0" ).record_load( "#11:1" )
+        pipe.query( "select from V limit 3" )
+        assert len( pipe ) == 3
+
+        first, second, vertices = pipe.execute()
+        assert len( pipe ) == 0
+        assert first._rid == "#11:0"
+        assert second._rid == "#11:1"
+        assert len( vertices ) == 3
+
+        # an error does not leave the other responses on the wire
+        pipe.query( "select from V limit 1" )
+        pipe.command( "selekt from V" )
+        pipe.query( "select from V limit 2" )
+        with self.assertRaises( pyorient.PyOrientSQLParsingException ):
+            pipe.execute()
+
+        assert len( client.query( "select from V limit 4" ) ) == 4
+
+    def test_pipeline_broken_response(self):
+
+        client = pyorient.OrientDB("localhost", 2424)
+        client.connect("root", "root")
+
+        db_name = "GratefulDeadConcerts"
+
+        cluster_info = client.db_open(
+            db_name, "admin", "admin", pyorient.DB_TYPE_GRAPH, ""
+        )
+
+        # the pre-fetched records need a callback: the first response
+        # can't be read to the end, so the second one would be garbage
+        pipe = client.pipeline()
+        pipe.record_load( "#11:0", "*:-1" ).record_load( "#11:1" )
+        with self.assertRaises( pyorient.PyOrientBadMethodCallException ):
+            pipe.execute()
+
+        assert client._connection.connected is False
+
 # x = CommandTestCase('test_command').run()
 
 # x = CommandTestCase('test_new_client_interface').run()
\ No newline at end of file